@@ -1,78 +1,680 @@
 import os
-import json
-from typing import Dict, Any, List
+import asyncio
+import atexit
+import base64
+import hashlib
+import functools
+import multiprocessing
+import tempfile
+import time
+import uuid
+import zipfile
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, List, Optional, Tuple, Union
 
 from mcp.server import Server
 from mcp.types import InitializeResult
 
 import httpx
-from qdrant_client import QdrantClient
+import orjson
+import numpy as np
+import tiktoken
+import zstandard
+from tenacity import (
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_exponential_jitter
+)
+import grpc
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.http.exceptions import UnexpectedResponse
 from qdrant_client.models import (
     VectorParams,
     Distance,
-    PointStruct
+    PointStruct,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    HnswConfigDiff,
+    SearchParams,
+    QuantizationSearchParams,
+    PayloadSchemaType,
+    FilterSelector,
+    Filter,
+    FieldCondition,
+    MatchAny
 )
 
 import google.oauth2.service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
+import google.auth.transport.requests
 import io
 
-import docx
-import PyPDF2
+from lxml import etree
+import pypdf
 
 GDRIVE_FOLDER_ID = os.environ.get("GDRIVE_FOLDER_ID", "")
 GOOGLE_CREDS_JSON = os.environ.get("GOOGLE_SERVICE_ACCOUNT_JSON")
 QDRANT_URL = os.environ.get("QDRANT_URL", "")
 QDRANT_API_KEY = os.environ.get("QDRANT_API_KEY", "")
+QDRANT_GRPC_PORT = int(os.environ.get("QDRANT_GRPC_PORT", 6334))
 QDRANT_COLLECTION = "rag_docs"
+GDRIVE_SEARCH_LIMIT = 25
+GDRIVE_API_URL = "https://www.googleapis.com/drive/v3"
+PDF_MIN_PAGES_PER_TASK = 8
+PDF_SPLIT_MIN_BYTES = 1024 * 1024
+GDRIVE_READ_MAX_PAGES = 50
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIM = 1536
+EMBED_CACHE_SIZE = 4096
+QUERY_CACHE_SIZE = 1024
+QUERY_CACHE_THRESHOLD = 0.92
+QUERY_CACHE_TTL = 300.0
+CHUNK_TOKENS = 512
+CHUNK_OVERLAP = 64
+PAYLOAD_COMPRESS_MIN = 1024
+UPSERT_BATCH_SIZE = 64
+UPSERT_CONCURRENCY = 16
+PIPELINE_QUEUE_SIZE = 16
+EMBED_RPS = float(os.environ.get("OPENAI_EMBED_RPS", "50"))
+EMBED_CONCURRENCY = 8
+EMBED_BATCH_SIZE = 100
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
 OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
+OPENAI_EMBEDDINGS_URL = "https://api.openai.com/v1/embeddings"
+OPENAI_HEADERS = {
+    "Authorization": f"Bearer {OPENAI_API_KEY}",
+    "Content-Type": "application/json"
+}
 
 server = Server("fh_mcp")
 
 
-def get_gdrive_service():
-    creds_info = json.loads(GOOGLE_CREDS_JSON)
-    creds = google.oauth2.service_account.Credentials.from_service_account_info(
+@functools.lru_cache(maxsize=1)
+def get_gdrive_credentials():
+    creds_info = orjson.loads(GOOGLE_CREDS_JSON)
+    return google.oauth2.service_account.Credentials.from_service_account_info(
         creds_info,
         scopes=["https://www.googleapis.com/auth/drive.readonly"]
     )
-    return build("drive", "v3", credentials=creds)
 
 
-def extract_text_from_file(file_bytes: bytes, mime_type: str):
-    if mime_type == "application/pdf":
-        reader = PyPDF2.PdfReader(io.BytesIO(file_bytes))
-        return "\n".join(page.extract_text() or "" for page in reader.pages)
+@functools.lru_cache(maxsize=1)
+def get_gdrive_auth_request():
+    return google.auth.transport.requests.Request()
+
+
+_GDRIVE_REFRESH_LOCK = asyncio.Lock()
+
+
+async def get_gdrive_headers() -> Dict[str, str]:
+    creds = get_gdrive_credentials()
+    if not creds.valid:
+        async with _GDRIVE_REFRESH_LOCK:
+            if not creds.valid:
+                await asyncio.to_thread(creds.refresh, get_gdrive_auth_request())
+    return {"Authorization": f"Bearer {creds.token}"}
+
+
+async def gdrive_get(path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    r = await get_http_client().get(
+        f"{GDRIVE_API_URL}{path}",
+        params=params,
+        headers=await get_gdrive_headers()
+    )
+    r.raise_for_status()
+    return orjson.loads(r.content)
+
+
+async def gdrive_download(path: str, params: Dict[str, Any]) -> io.BytesIO:
+    fh = io.BytesIO()
+    async with get_http_client().stream(
+        "GET",
+        f"{GDRIVE_API_URL}{path}",
+        params=params,
+        headers=await get_gdrive_headers()
+    ) as r:
+        r.raise_for_status()
+        async for chunk in r.aiter_bytes():
+            fh.write(chunk)
+    return fh
+
+
+_DOCX_RUN_TEXT = {
+    W_NS + "tab": "\t",
+    W_NS + "ptab": "\t",
+    W_NS + "cr": "\n",
+    W_NS + "noBreakHyphen": "-"
+}
+
+
+def extract_docx_text(fh: io.BytesIO) -> str:
+    # Stream word/document.xml instead of building python-docx's object model.
+    # Only run content counts, so tab-stop definitions in w:pPr are skipped,
+    # and a stack keeps text-box paragraphs from mixing with their host.
+    paragraphs = []
+    stack = []
+    with zipfile.ZipFile(fh) as z, z.open("word/document.xml") as f:
+        tags = (W_NS + "p", W_NS + "t", W_NS + "br", *_DOCX_RUN_TEXT)
+        for event, el in etree.iterparse(f, events=("start", "end"), tag=tags):
+            if el.tag == W_NS + "p":
+                if event == "start":
+                    stack.append([])
+                    continue
+                paragraphs.append("".join(stack.pop()))
+                # Drop finished paragraphs from the tree so memory stays bounded.
+                el.clear()
+                while el.getprevious() is not None:
+                    del el.getparent()[0]
+                continue
+            if event == "start" or not stack or el.getparent().tag != W_NS + "r":
+                continue
+            if el.tag == W_NS + "t":
+                stack[-1].append(el.text or "")
+            elif el.tag == W_NS + "br":
+                if el.get(W_NS + "type", "textWrapping") == "textWrapping":
+                    stack[-1].append("\n")
+            else:
+                stack[-1].append(_DOCX_RUN_TEXT[el.tag])
+    return "\n".join(paragraphs)
+
+
+def extract_text_from_file(data: bytes, mime_type: str):
     if mime_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-        doc = docx.Document(io.BytesIO(file_bytes))
-        return "\n".join(p.text for p in doc.paragraphs)
+        return extract_docx_text(io.BytesIO(data))
     if mime_type.startswith("text/"):
-        return file_bytes.decode("utf-8", errors="ignore")
+        return data.decode("utf-8", errors="ignore")
     return ""
 
 
-qdrant = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
+_ENCODING = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+
+
+def chunk_text(text: str, size: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    ids = _ENCODING.encode_ordinary(text)
+    if not ids:
+        return []
+    return [
+        _ENCODING.decode(ids[i:i + size])
+        for i in range(0, max(len(ids) - overlap, 1), size - overlap)
+    ]
 
-if not qdrant.collection_exists(QDRANT_COLLECTION):
-    qdrant.create_collection(
-        collection_name=QDRANT_COLLECTION,
-        vectors_config=VectorParams(
-            size=1536,
-            distance=Distance.COSINE
+
+def chunk_texts(texts: List[str]) -> List[List[str]]:
+    return [chunk_text(text) for text in texts]
+
+
+_POOL: Optional[ProcessPoolExecutor] = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _POOL
+    if _POOL is None:
+        # Forking once gRPC and executor threads are running can deadlock the
+        # child, so start workers from a clean forkserver (spawn on Windows).
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _POOL = ProcessPoolExecutor(
+            max_workers=os.cpu_count(),
+            mp_context=multiprocessing.get_context(method)
         )
-    )
+        atexit.register(_POOL.shutdown, wait=False, cancel_futures=True)
+    return _POOL
+
+
+def _discard_process_pool(pool: ProcessPoolExecutor):
+    global _POOL
+    if _POOL is pool:
+        _POOL = None
+    atexit.unregister(pool.shutdown)
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_in_process(fn, *args):
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    try:
+        return await loop.run_in_executor(pool, fn, *args)
+    except BrokenProcessPool:
+        # A crashed worker (e.g. OOM on a huge PDF) breaks the pool for good;
+        # replace it so ingestion keeps working, and retry once.
+        _discard_process_pool(pool)
+        return await loop.run_in_executor(get_process_pool(), fn, *args)
+
+
+def _open_pdf(src: Union[bytes, str]) -> pypdf.PdfReader:
+    return pypdf.PdfReader(io.BytesIO(src) if isinstance(src, bytes) else src)
+
+
+def count_pdf_pages(src: Union[bytes, str]) -> int:
+    return len(_open_pdf(src).pages)
+
+
+def extract_pdf_pages(src: Union[bytes, str], start: int, stop: int) -> Tuple[str, int]:
+    reader = _open_pdf(src)
+    total_pages = len(reader.pages)
+    stop = min(stop, total_pages)
+    return "\n".join(reader.pages[i].extract_text() or "" for i in range(start, stop)), total_pages
+
+
+def _spool_to_file(fh: io.BytesIO, suffix: str) -> str:
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+        f.write(fh.getbuffer())
+    return f.name
 
 
-async def get_embedding(text: str) -> List[float]:
-    async with httpx.AsyncClient() as client:
+async def extract_text(fh: io.BytesIO, mime_type: str, max_pages: int) -> Tuple[str, bool]:
+    # Workers get plain bytes; pickling the BytesIO would copy it anyway.
+    if mime_type != "application/pdf":
+        return await run_in_process(extract_text_from_file, fh.getvalue(), mime_type), False
+
+    # Small PDFs are read in one round-trip; larger ones are split across the
+    # pool so every core works. Content streams past max_pages are never parsed.
+    if fh.getbuffer().nbytes < PDF_SPLIT_MIN_BYTES:
+        text, total_pages = await run_in_process(extract_pdf_pages, fh.getvalue(), 0, max_pages)
+        return text, max_pages < total_pages
+
+    # Spool large PDFs to disk once and send workers only the path, rather
+    # than a pickled copy of the bytes per slice.
+    path = await asyncio.to_thread(_spool_to_file, fh, ".pdf")
+    try:
+        total_pages = await run_in_process(count_pdf_pages, path)
+        n_pages = min(total_pages, max_pages)
+        step = max(PDF_MIN_PAGES_PER_TASK, -(-n_pages // (os.cpu_count() or 1)))
+        parts = await asyncio.gather(*[
+            run_in_process(extract_pdf_pages, path, start, min(start + step, n_pages))
+            for start in range(0, n_pages, step)
+        ])
+    finally:
+        os.unlink(path)
+    return "\n".join(text for text, _ in parts), n_pages < total_pages
+
+
+_QDRANT: Optional[AsyncQdrantClient] = None
+
+
+def get_qdrant() -> AsyncQdrantClient:
+    # Built on first use: the constructor may check the server version, which
+    # must not happen at import in the main process or in pool workers.
+    global _QDRANT
+    if _QDRANT is None:
+        _QDRANT = AsyncQdrantClient(
+            url=QDRANT_URL,
+            api_key=QDRANT_API_KEY,
+            prefer_grpc=True,
+            grpc_port=QDRANT_GRPC_PORT,
+            timeout=60,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+        )
+    return _QDRANT
+
+_COLLECTION_READY = False
+_COLLECTION_LOCK = asyncio.Lock()
+
+
+async def ensure_collection():
+    global _COLLECTION_READY
+    if _COLLECTION_READY:
+        return
+    async with _COLLECTION_LOCK:
+        if _COLLECTION_READY:
+            return
+        if not await get_qdrant().collection_exists(QDRANT_COLLECTION):
+            try:
+                await get_qdrant().create_collection(
+                    collection_name=QDRANT_COLLECTION,
+                    vectors_config=VectorParams(
+                        size=EMBEDDING_DIM,
+                        distance=Distance.DOT
+                    ),
+                    hnsw_config=HnswConfigDiff(m=16, ef_construct=128),
+                    quantization_config=ScalarQuantization(
+                        scalar=ScalarQuantizationConfig(
+                            type=ScalarType.INT8,
+                            quantile=0.99,
+                            always_ram=True
+                        )
+                    )
+                )
+            except (UnexpectedResponse, grpc.RpcError):
+                # Another worker may have created it between the check and the create.
+                if not await get_qdrant().collection_exists(QDRANT_COLLECTION):
+                    raise
+            await get_qdrant().create_payload_index(
+                collection_name=QDRANT_COLLECTION,
+                field_name="doc_id",
+                field_schema=PayloadSchemaType.KEYWORD
+            )
+        _COLLECTION_READY = True
+
+
+_HTTP: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _HTTP
+    if _HTTP is None:
+        _HTTP = httpx.AsyncClient(
+            http2=True,
+            timeout=30.0,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+        )
+    return _HTTP
+
+
+class AsyncRateLimiter:
+    def __init__(self, rps: float):
+        self.interval = 1.0 / rps
+        self.next_call = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+_EMBED_LIMITER = AsyncRateLimiter(EMBED_RPS)
+_EMBED_SEM = asyncio.Semaphore(EMBED_CONCURRENCY)
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(exc, httpx.TransportError)
+
+
+def normalize(vec: List[float]) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32)
+    v /= np.linalg.norm(v) + 1e-12
+    return v
+
+
+@retry(
+    wait=wait_exponential_jitter(initial=1, max=30),
+    stop=stop_after_attempt(5),
+    retry=retry_if_exception(_is_retryable),
+    reraise=True
+)
+async def _request_embeddings(texts: List[str]) -> List[np.ndarray]:
+    client = get_http_client()
+    await _EMBED_LIMITER.acquire()
+    async with _EMBED_SEM:
         r = await client.post(
-            "https://api.openai.com/v1/embeddings",
-            headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
-            json={"model": "text-embedding-3-small", "input": text}
+            OPENAI_EMBEDDINGS_URL,
+            headers=OPENAI_HEADERS,
+            content=orjson.dumps({"model": EMBEDDING_MODEL, "input": texts})
+        )
+    r.raise_for_status()
+    data = sorted(orjson.loads(r.content)["data"], key=lambda d: d["index"])
+    return [normalize(d["embedding"]) for d in data]
+
+
+_EMBED_CACHE: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+
+
+def _embed_cache_key(text: str) -> tuple:
+    return EMBEDDING_MODEL, hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+
+_INFLIGHT: Dict[tuple, asyncio.Future] = {}
+_FETCH_TASKS = set()
+
+
+async def _fetch_embeddings(pending: Dict[tuple, str]):
+    # Resolves the _INFLIGHT futures for ``pending``; callers await those
+    # futures, so ordinary errors are delivered through them rather than
+    # raised here.
+    try:
+        # Similar-length texts share a request so batches stay balanced; the
+        # requests then run concurrently, capped by _EMBED_SEM.
+        items = sorted(pending.items(), key=lambda kv: len(kv[1]))
+        batches = [
+            items[i:i + EMBED_BATCH_SIZE]
+            for i in range(0, len(items), EMBED_BATCH_SIZE)
+        ]
+        fetched = await asyncio.gather(*[
+            _request_embeddings([text for _, text in batch])
+            for batch in batches
+        ])
+        for batch, embs in zip(batches, fetched):
+            for (key, _), emb in zip(batch, embs):
+                _EMBED_CACHE[key] = emb
+                _INFLIGHT.pop(key).set_result(emb)
+        while len(_EMBED_CACHE) > EMBED_CACHE_SIZE:
+            _EMBED_CACHE.popitem(last=False)
+    except BaseException as exc:
+        for key in pending:
+            fut = _INFLIGHT.pop(key, None)
+            if fut is None or fut.done():
+                continue
+            if isinstance(exc, asyncio.CancelledError):
+                fut.cancel()
+            else:
+                fut.set_exception(exc)
+        # Cancellation must still propagate so the task ends up cancelled.
+        if not isinstance(exc, Exception):
+            raise
+
+
+async def get_embeddings(texts: List[str]) -> List[np.ndarray]:
+    keys = [_embed_cache_key(t) for t in texts]
+    result: List[Any] = []
+    owned: Dict[tuple, str] = {}
+    loop = asyncio.get_running_loop()
+    for key, text in zip(keys, texts):
+        emb = _EMBED_CACHE.get(key)
+        if emb is not None:
+            _EMBED_CACHE.move_to_end(key)
+        else:
+            # Texts already being embedded by another caller share its request.
+            emb = _INFLIGHT.get(key)
+            if emb is None:
+                emb = _INFLIGHT[key] = loop.create_future()
+                owned[key] = text
+        result.append(emb)
+
+    if owned:
+        task = asyncio.ensure_future(_fetch_embeddings(owned))
+        _FETCH_TASKS.add(task)
+        task.add_done_callback(_FETCH_TASKS.discard)
+    # shield() keeps a cancelled caller from cancelling shared futures, and
+    # gathering them all marks every failed future's exception as retrieved.
+    futs = [emb for emb in result if isinstance(emb, asyncio.Future)]
+    if futs:
+        await asyncio.gather(*[asyncio.shield(fut) for fut in futs])
+    return [
+        emb.result() if isinstance(emb, asyncio.Future) else emb
+        for emb in result
+    ]
+
+
+async def get_embedding(text: str) -> np.ndarray:
+    return (await get_embeddings([text]))[0]
+
+
+_ZSTD_COMPRESSOR = zstandard.ZstdCompressor(level=3)
+_ZSTD_DECOMPRESSOR = zstandard.ZstdDecompressor()
+
+
+def encode_text_payload(text: str) -> Dict[str, str]:
+    # Large chunk texts are stored zstd-compressed under "z" to shrink Qdrant
+    # payload storage and search responses; short ones stay plain.
+    raw = text.encode()
+    if len(raw) < PAYLOAD_COMPRESS_MIN:
+        return {"text": text}
+    return {"z": base64.b64encode(_ZSTD_COMPRESSOR.compress(raw)).decode("ascii")}
+
+
+def decode_text_payload(payload: Dict[str, Any]) -> str:
+    if "z" in payload:
+        return _ZSTD_DECOMPRESSOR.decompress(base64.b64decode(payload["z"])).decode()
+    return payload.get("text", "")
+
+
+def chunk_point_id(doc_id: str, chunk_ix: int) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{doc_id}:{chunk_ix}"))
+
+
+async def embed_documents(items: List[Dict[str, Any]]) -> List[PointStruct]:
+    chunked = await run_in_process(chunk_texts, [item["text"] for item in items])
+    chunks = [
+        (item["doc_id"], ix, text)
+        for item, texts in zip(items, chunked)
+        for ix, text in enumerate(texts)
+    ]
+    embs = await get_embeddings([text for _, _, text in chunks]) if chunks else []
+    return [
+        PointStruct(
+            id=chunk_point_id(doc_id, ix),
+            vector=emb.tolist(),
+            payload={**encode_text_payload(text), "doc_id": doc_id, "chunk_ix": ix}
+        )
+        for (doc_id, ix, text), emb in zip(chunks, embs)
+    ]
+
+
+class QueryCache:
+    # Recent rag_search results keyed by normalized query text. Vectors live in
+    # one preallocated matrix so a similarity lookup is a single mat-vec
+    # product; embeddings are unit-length, so the dot product is the cosine.
+    def __init__(self, size: int, threshold: float, ttl: float):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.vectors = np.zeros((size, EMBEDDING_DIM), dtype=np.float32)
+        self.expires = np.zeros(size)
+        self.results: List[Any] = [None] * size
+        self.keys: List[Optional[str]] = [None] * size
+        self.slots: "OrderedDict[str, int]" = OrderedDict()
+        self.free = list(range(size))
+        self.generation = 0
+
+    @staticmethod
+    def _key(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def get(self, query: str):
+        key = self._key(query)
+        slot = self.slots.get(key)
+        if slot is None or self.expires[slot] <= time.monotonic():
+            return None
+        self.slots.move_to_end(key)
+        return self.results[slot]
+
+    def get_similar(self, vec: np.ndarray):
+        if not self.slots:
+            return None
+        scores = self.vectors @ vec
+        scores[self.expires <= time.monotonic()] = -np.inf
+        slot = int(np.argmax(scores))
+        if scores[slot] < self.threshold:
+            return None
+        self.slots.move_to_end(self.keys[slot])
+        return self.results[slot]
+
+    def put(self, query: str, vec: np.ndarray, results: Any, generation: int):
+        if generation != self.generation:
+            return
+        key = self._key(query)
+        slot = self.slots.pop(key, None)
+        if slot is None:
+            slot = self.free.pop() if self.free else self.slots.popitem(last=False)[1]
+        self.vectors[slot] = vec
+        self.expires[slot] = time.monotonic() + self.ttl
+        self.results[slot] = results
+        self.keys[slot] = key
+        self.slots[key] = slot
+
+    def clear(self):
+        self.generation += 1
+        self.expires[:] = 0
+        self.results = [None] * len(self.results)
+        self.keys = [None] * len(self.keys)
+        self.slots.clear()
+        self.free = list(range(len(self.results)))
+
+
+_QUERY_CACHE = QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_THRESHOLD, QUERY_CACHE_TTL)
+
+
+async def write_points(doc_ids: List[str], points: List[PointStruct], wait: bool = False):
+    await ensure_collection()
+    try:
+        # Drop chunks left over from a previous, longer version of the same docs.
+        await get_qdrant().delete(
+            collection_name=QDRANT_COLLECTION,
+            points_selector=FilterSelector(
+                filter=Filter(must=[
+                    FieldCondition(key="doc_id", match=MatchAny(any=doc_ids))
+                ])
+            ),
+            wait=wait
         )
-        j = r.json()
-        return j["data"][0]["embedding"]
+        if points:
+            await get_qdrant().upsert(
+                collection_name=QDRANT_COLLECTION,
+                points=points,
+                wait=wait
+            )
+    finally:
+        # Invalidate only once the write is acknowledged, so any search that
+        # started before this point cannot cache pre-write hits. With
+        # wait=False Qdrant may still be applying the write, so the cache is
+        # only eventually consistent with it until the next write or TTL.
+        _QUERY_CACHE.clear()
+
+
+async def upsert_documents(items: List[Dict[str, Any]], wait: bool = False):
+    points = await embed_documents(items)
+    await write_points([item["doc_id"] for item in items], points, wait=wait)
+
+
+async def upsert_documents_bulk(items: List[Dict[str, Any]], wait: bool = False):
+    # Bounded two-stage pipeline: embedding and Qdrant writes overlap, and the
+    # queues apply back-pressure so only a few batches are in flight at once.
+    embed_queue: asyncio.Queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    write_queue: asyncio.Queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+
+    async def produce():
+        for i in range(0, len(items), UPSERT_BATCH_SIZE):
+            await embed_queue.put(items[i:i + UPSERT_BATCH_SIZE])
+        for _ in range(EMBED_CONCURRENCY):
+            await embed_queue.put(None)
+
+    async def embed_worker():
+        while (batch := await embed_queue.get()) is not None:
+            await write_queue.put((batch, await embed_documents(batch)))
+
+    async def close_writes():
+        await asyncio.gather(*embed_tasks)
+        for _ in range(UPSERT_CONCURRENCY):
+            await write_queue.put(None)
+
+    async def write_worker():
+        while (job := await write_queue.get()) is not None:
+            batch, points = job
+            await write_points([item["doc_id"] for item in batch], points, wait=wait)
+
+    # Every worker is tracked here so a failure anywhere cancels all of them.
+    embed_tasks = [asyncio.ensure_future(embed_worker()) for _ in range(EMBED_CONCURRENCY)]
+    tasks = [
+        asyncio.ensure_future(produce()),
+        *embed_tasks,
+        asyncio.ensure_future(close_writes()),
+        *[asyncio.ensure_future(write_worker()) for _ in range(UPSERT_CONCURRENCY)]
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
 
 
 @server.on("initialize")
@@ -93,7 +695,10 @@ async def on_tools_list(request, response):
                 "description": "Search files in Google Drive folder",
                 "inputSchema": {
                     "type": "object",
-                    "properties": {"query": {"type": "string"}},
+                    "properties": {
+                        "query": {"type": "string"},
+                        "limit": {"type": "integer"}
+                    },
                     "required": ["query"]
                 }
             },
@@ -102,7 +707,10 @@ async def on_tools_list(request, response):
                 "description": "Read & extract text from Google Drive file",
                 "inputSchema": {
                     "type": "object",
-                    "properties": {"file_id": {"type": "string"}},
+                    "properties": {
+                        "file_id": {"type": "string"},
+                        "max_pages": {"type": "integer"}
+                    },
                     "required": ["file_id"]
                 }
             },
@@ -113,17 +721,43 @@ async def on_tools_list(request, response):
                     "type": "object",
                     "properties": {
                         "doc_id": {"type": "string"},
-                        "text": {"type": "string"}
+                        "text": {"type": "string"},
+                        "wait": {"type": "boolean"}
                     },
                     "required": ["doc_id", "text"]
                 }
             },
+            {
+                "name": "rag_upsert_batch",
+                "description": "Add several documents to Qdrant RAG in one request",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "items": {
+                            "type": "array",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "doc_id": {"type": "string"},
+                                    "text": {"type": "string"}
+                                },
+                                "required": ["doc_id", "text"]
+                            }
+                        },
+                        "wait": {"type": "boolean"}
+                    },
+                    "required": ["items"]
+                }
+            },
             {
                 "name": "rag_search",
                 "description": "Search Qdrant RAG",
                 "inputSchema": {
                     "type": "object",
-                    "properties": {"query": {"type": "string"}},
+                    "properties": {
+                        "query": {"type": "string"},
+                        "no_cache": {"type": "boolean"}
+                    },
                     "required": ["query"]
                 }
             }
@@ -137,67 +771,84 @@ async def on_tools_call(request, response):
     args = request.params.get("arguments", {})
 
     if tool == "gdrive_search":
-        query = args["query"]
-        service = get_gdrive_service()
-        res = service.files().list(
-            q=f"'{GDRIVE_FOLDER_ID}' in parents and trashed=false and name contains '{query}'",
-            fields="files(id, name, mimeType)"
-        ).execute()
-        return {"files": res.get("files", [])}
+        query = args["query"].replace("\\", "\\\\").replace("'", "\\'")
+        params = {
+            "q": f"'{GDRIVE_FOLDER_ID}' in parents and trashed=false and name contains '{query}'",
+            "fields": "nextPageToken, files(id, name, mimeType)",
+            "spaces": "drive"
+        }
+        limit = args.get("limit", GDRIVE_SEARCH_LIMIT)
+        files = []
+        while len(files) < limit:
+            params["pageSize"] = min(limit - len(files), 100)
+            res = await gdrive_get("/files", params)
+            files.extend(res.get("files", []))
+            if "nextPageToken" not in res:
+                break
+            params["pageToken"] = res["nextPageToken"]
+        return {"files": files[:limit]}
 
     if tool == "gdrive_read":
-        file_id = args["file_id"]
-        service = get_gdrive_service()
-        meta = service.files().get(fileId=file_id, fields="id,name,mimeType").execute()
+        file_id = urllib.parse.quote(args["file_id"], safe="")
+        meta = await gdrive_get(f"/files/{file_id}", {"fields": "id,name,mimeType"})
         mime = meta["mimeType"]
 
         if mime.startswith("application/vnd.google-apps"):
-            req = service.files().export_media(fileId=file_id, mimeType="application/pdf")
+            fh = await gdrive_download(f"/files/{file_id}/export", {"mimeType": "application/pdf"})
+            mime = "application/pdf"
         else:
-            req = service.files().get_media(fileId=file_id)
+            fh = await gdrive_download(f"/files/{file_id}", {"alt": "media"})
 
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, req)
-        done = False
-        while not done:
-            _, done = downloader.next_chunk()
-
-        text = extract_text_from_file(fh.getvalue(), mime)
-        return {"text": text}
+        text, truncated = await extract_text(
+            fh, mime, args.get("max_pages", GDRIVE_READ_MAX_PAGES)
+        )
+        return {"text": text, "truncated": truncated}
 
     if tool == "rag_upsert":
-        doc_id = args["doc_id"]
-        text = args["text"]
-        emb = await get_embedding(text)
-        qdrant.upsert(
-            collection_name=QDRANT_COLLECTION,
-            points=[
-                PointStruct(
-                    id=doc_id,
-                    vector=emb,
-                    payload={"text": text}
-                )
-            ]
+        await upsert_documents(
+            [{"doc_id": args["doc_id"], "text": args["text"]}],
+            wait=args.get("wait", False)
         )
         return {"status": "ok"}
 
+    if tool == "rag_upsert_batch":
+        items = args["items"]
+        await upsert_documents_bulk(items, wait=args.get("wait", False))
+        return {"status": "ok", "count": len(items)}
+
     if tool == "rag_search":
         query = args["query"]
+        use_cache = not args.get("no_cache", False)
+        generation = _QUERY_CACHE.generation
+        results = _QUERY_CACHE.get(query) if use_cache else None
+        if results is not None:
+            return {"results": results}
+
         emb = await get_embedding(query)
-        hits = qdrant.search(
+        results = _QUERY_CACHE.get_similar(emb) if use_cache else None
+        if results is not None:
+            return {"results": results}
+
+        await ensure_collection()
+        hits = await get_qdrant().search(
             collection_name=QDRANT_COLLECTION,
             query_vector=emb,
-            limit=5
+            limit=5,
+            search_params=SearchParams(
+                quantization=QuantizationSearchParams(rescore=True, oversampling=2.0)
+            )
         )
-        return {
-            "results": [
-                {
-                    "score": h.score,
-                    "text": h.payload.get("text", "")
-                }
-                for h in hits
-            ]
-        }
+        results = [
+            {
+                "score": h.score,
+                "text": decode_text_payload(h.payload),
+                "doc_id": h.payload.get("doc_id"),
+                "chunk_ix": h.payload.get("chunk_ix")
+            }
+            for h in hits
+        ]
+        _QUERY_CACHE.put(query, emb, results, generation)
+        return {"results": results}
 
     # NEW: correct MCP-style error response
     return {
@@ -209,5 +860,13 @@ async def on_tools_call(request, response):
 
 
 if __name__ == "__main__":
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+
     port = int(os.environ.get("PORT", 8000))
+    # Shared clients are bound to the serving loop and there is no lifespan
+    # hook to close them on it; process exit reclaims their sockets.
     server.run_http("0.0.0.0", port, path="/mcp")